@@ -18,6 +18,7 @@
 from typing import List, Optional, Set, Tuple, Union
 
 from tvm import arith, ir, tir
+from tvm.runtime import DataType
 from tvm.target import Target
 
 from ..base import (
@@ -29,6 +30,36 @@ from ..base import (
 from . import utils
 
 
+# Thread extents of the spatial (threadIdx.x) and reduction (threadIdx.y) axes in the
+# inner-spatial schedule
+_INNER_SPATIAL_TX, _INNER_SPATIAL_TY = 16, 16
+
+# Vector length of the broadcast epilogue in the inner-reduction schedule. Four lanes keep both
+# fp16 loads and fp32 intermediates within the native vector types of the GPU backends.
+_EPILOGUE_VECTOR_LEN = 4
+
+
+def _has_reduction_block(func: tir.PrimFunc) -> bool:
+    # Check whether any block directly under the root block carries an init statement, i.e.
+    # whether `func` may contain a reduction, without constructing a schedule. Statements other
+    # than loops and sequences are conservatively treated as possibly containing one.
+    if not isinstance(func.body, tir.BlockRealize):
+        return True
+    stmts = [func.body.block.body]
+    while stmts:
+        stmt = stmts.pop()
+        if isinstance(stmt, tir.SeqStmt):
+            stmts.extend(stmt.seq)
+        elif isinstance(stmt, tir.For):
+            stmts.append(stmt.body)
+        elif isinstance(stmt, tir.BlockRealize):
+            if stmt.block.init is not None:
+                return True
+        else:
+            return True
+    return False
+
+
 def _get_reduction_expr(block: tir.Block) -> Optional[tir.PrimExpr]:
     # Detect and return `Y` in `X[...] = X[...] + Y`
     buffer_store = block.body
@@ -36,53 +67,121 @@ def _get_reduction_expr(block: tir.Block) -> Optional[tir.PrimExpr]:
         return None
     if not isinstance(buffer_store.value, tir.Add):
         return None
-    if not ir.structural_equal(
-        buffer_store.value.a,
-        tir.BufferLoad(buffer_store.buffer, block.body.indices),
-        map_free_vars=True,
-    ):
+    buffer_load = buffer_store.value.a
+    if not isinstance(buffer_load, tir.BufferLoad):
+        return None
+    if not buffer_load.buffer.same_as(buffer_store.buffer):
         return None
+    if len(buffer_load.indices) != len(buffer_store.indices):
+        return None
+    for load_index, store_index in zip(buffer_load.indices, buffer_store.indices):
+        if not load_index.same_as(store_index) and not ir.structural_equal(load_index, store_index):
+            return None
     return buffer_store.value.b
 
 
-def _collect_vars_used_in_access_region(region: List[ir.Range]) -> Set[tir.Var]:
-    tir_vars: Set[tir.Var] = set()
-
-    def _collect_tir_var(expr):
-        if isinstance(expr, tir.Var):
-            tir_vars.add(expr)
-
+def _count_vars_used_in_access_region(region: List[ir.Range], iter_var_addrs: Set[int]) -> int:
+    # `undefined_vars` walks each index in C++, instead of calling back into Python per node.
+    # Vars are deduplicated by the address of the underlying object, which avoids the FFI calls
+    # behind `tir.Var.__hash__` and `tir.Var.__eq__`. Only the block iters in `iter_var_addrs` are
+    # counted, since `undefined_vars` also reports the data and shape vars of any buffer loaded
+    # inside an index, e.g. `row_idx` in `V[row_idx[0], k]`.
+    var_addrs: Set[int] = set()
     for expr in region:
         assert expr.extent == 1
-        tir.stmt_functor.post_order_visit(expr.min, _collect_tir_var)
-    return tir_vars
+        for var in tir.analysis.undefined_vars(expr.min):
+            var_addrs.add(var.handle.value)
+    return len(var_addrs & iter_var_addrs)
 
 
-def _detect_dominant_read(block: tir.Block) -> tir.PrimExpr:
+def _detect_dominant_read(block: tir.Block) -> Optional[tir.PrimExpr]:
+    # The reduction buffer is read back by `X[...] = X[...] + Y`, but it never carries the
+    # reduction iters, so it cannot be the dominant read and is not worth analyzing
+    write_buffers = {r.buffer for r in block.writes}
+    iter_var_addrs = {i.var.handle.value for i in block.iter_vars}
     dominant_read = None
     num_read_iters = -1
     for buffer_region in block.reads:
-        tir_vars = _collect_vars_used_in_access_region(buffer_region.region)
-        if num_read_iters < len(tir_vars):
-            num_read_iters = len(tir_vars)
+        if buffer_region.buffer in write_buffers:
+            continue
+        num_vars = _count_vars_used_in_access_region(buffer_region.region, iter_var_addrs)
+        if num_read_iters < num_vars:
+            num_read_iters = num_vars
             dominant_read = buffer_region
-    assert dominant_read is not None
+    if dominant_read is None:
+        # e.g. `X[...] = X[...] + 1`, which reads nothing but its own output
+        return None
     (result,) = dominant_read.buffer.offset_of([e.min for e in dominant_read.region])
     return result
 
 
+def _get_vector_read_buffers(block: tir.Block, chunk_len: int) -> List[tir.Buffer]:
+    # Detect the buffers indexed by the reduction iter only, e.g. `V` in `C[i] += V[k] * B[i, k]`,
+    # that are unit-stride along it, so that every aligned chunk of `chunk_len` consecutive
+    # reduction steps reads an aligned, contiguous chunk of the buffer
+    reduction_iters = [
+        iter_var
+        for iter_var in block.iter_vars
+        if iter_var.iter_type == tir.IterVar.CommReduce
+        and not (isinstance(iter_var.dom.extent, tir.IntImm) and iter_var.dom.extent.value == 1)
+    ]
+    if len(reduction_iters) != 1:
+        return []
+    (k,) = [iter_var.var for iter_var in reduction_iters]
+    write_buffers = {r.buffer for r in block.writes}
+    result = []
+    for buffer_region in block.reads:
+        buffer = buffer_region.buffer
+        if buffer in write_buffers or buffer.strides:
+            continue
+        if len([r for r in block.reads if r.buffer.same_as(buffer)]) != 1:
+            continue
+        *outer, inner = buffer_region.region
+        if any(tir.analysis.undefined_vars(expr.min) for expr in outer):
+            continue
+        coeffs = arith.detect_linear_equation(inner.min, [k])
+        if len(coeffs) != 2:
+            continue
+        stride, base = coeffs
+        if not (isinstance(stride, tir.IntImm) and stride.value == 1):
+            continue
+        if not (isinstance(base, tir.IntImm) and base.value % chunk_len == 0):
+            continue
+        len_inner = buffer.shape[-1]
+        if not (isinstance(len_inner, tir.IntImm) and len_inner.value % chunk_len == 0):
+            continue
+        offset = buffer.elem_offset
+        if not (isinstance(offset, tir.IntImm) and offset.value % chunk_len == 0):
+            continue
+        result.append(buffer)
+    return result
+
+
+def _get_max_vector_len(target: Target, dtype: str) -> int:
+    # CUDA handles vectors of up to 128 bits, while other GPU backends (e.g. Metal and WebGPU) are
+    # only guaranteed to handle up to 4 lanes
+    bits = DataType(dtype).bits
+    if bits < 8:
+        return 1
+    if target.kind.name == "cuda":
+        return 128 // bits
+    return min(4, 128 // bits)
+
+
 def _is_broadcast_epilogue(
     sch: tir.Schedule,
     block: tir.schedule.BlockRV,
     epilogue: tir.schedule.BlockRV,
 ) -> bool:
     write_buffers = {r.buffer for r in sch.get(block).writes}
-    epilogue_iters = {i.var: i for i in sch.get(epilogue).iter_vars if i.dom != 1}
-    for buffer_region in sch.get(epilogue).reads:
+    epilogue_stmt = sch.get(epilogue)
+    epilogue_iters = {i.var: i for i in epilogue_stmt.iter_vars if i.dom != 1}
+    iter_var_addrs = {i.var.handle.value for i in epilogue_stmt.iter_vars}
+    for buffer_region in epilogue_stmt.reads:
         if buffer_region.buffer not in write_buffers:
             continue
-        tir_vars = _collect_vars_used_in_access_region(buffer_region.region)
-        if len(tir_vars) < len(epilogue_iters):
+        num_vars = _count_vars_used_in_access_region(buffer_region.region, iter_var_addrs)
+        if num_vars < len(epilogue_iters):
             return True
     return False
 
@@ -94,9 +193,9 @@ class DecodeGEMV(ScheduleRule):
         self,
         func: tir.PrimFunc,
         target: Target,
-        _: bool,
+        tunable: bool,
     ) -> Union[None, tir.Schedule, List[tir.Schedule]]:
-        if not isinstance(func, tir.PrimFunc):
+        if not isinstance(func, tir.PrimFunc) or not _has_reduction_block(func):
             return None
         sch = tir.Schedule(func)
         block_infos = normalize_prim_func(sch)
@@ -123,20 +222,26 @@ class DecodeGEMV(ScheduleRule):
             or _get_reduction_expr(block_stmt) is None
         ):
             return None
+        # Cheap structural check before invoking the arithmetic analysis: the normalized block
+        # must consist of spatial and reduction iters only. Normalization drops unit iters and
+        # always keeps a spatial one, so this rejects blocks without a non-unit reduction iter.
+        if set(block_info.dom_kind()) != {"S", "R"}:
+            return None
         # Step 2. Normalize the block, merge spatial and reduction iters
+        dominant_read = _detect_dominant_read(block_stmt)
+        if dominant_read is None:
+            return None
+        input_iters = {i.var: i.dom for i in block_stmt.iter_vars}
         is_inner_reduction, c_factor = self._normalize(
             sch,
             block_info,
-            arith.normalize_to_iter_sum(
-                _detect_dominant_read(block_stmt),
-                input_iters={i.var: i.dom for i in block_stmt.iter_vars},
-            ),
+            arith.normalize_to_iter_sum(dominant_read, input_iters=input_iters),
         )
         if is_inner_reduction is None and c_factor is None:
             return None
         # Step 3. Do the scheduling
         if is_inner_reduction:
-            self._sch_inner_reduction(sch, target, block, c_factor, epilogue)
+            self._sch_inner_reduction(sch, target, block, c_factor, epilogue, tunable)
         else:
             self._sch_inner_spatial(sch, target, block, c_factor, epilogue)
         return sch
@@ -149,11 +254,16 @@ class DecodeGEMV(ScheduleRule):
     ) -> Tuple[Optional[bool], Optional[int]]:
         if access.base != 0:
             return None, None
-        iter_to_info = {i.var: i for i in block_info.iters}
+        iters = block_info.iters
+        var_to_idx = {info.var: idx for idx, info in enumerate(iters)}
+        consumed = [False] * len(iters)
         s_loops, r_loops, c_loops, c_factor = [], [], [], None
         for split_expr in access.args:
-            var = split_expr.source.source
-            info = iter_to_info.pop(var)
+            idx = var_to_idx[split_expr.source.source]
+            if consumed[idx]:
+                return None, None
+            consumed[idx] = True
+            info = iters[idx]
             loop = info.loop_rv
             is_inner_reduction = info.kind == "R"
             if split_expr.lower_factor > 1:
@@ -168,15 +278,16 @@ class DecodeGEMV(ScheduleRule):
             else:
                 s_loops.append(loop)
 
-        if iter_to_info:
-            for var, info in iter_to_info.items():
-                if info.kind == "S" and info.dom == 1:
-                    s_loops.append(info.loop_rv)
-                else:
-                    return None, None
+        for idx, info in enumerate(iters):
+            if consumed[idx]:
+                continue
+            if info.kind == "S" and info.dom == 1:
+                s_loops.append(info.loop_rv)
+            else:
+                return None, None
         assert s_loops
         assert r_loops
-        if len(s_loops) != len([i for i in block_info.iters if i.kind == "S"]):
+        if len(s_loops) != len([i for i in iters if i.kind == "S"]):
             return None, None
         if not c_loops:
             c_loops = [sch.add_unit_loop(block_info.block_rv)]
@@ -185,29 +296,72 @@ class DecodeGEMV(ScheduleRule):
         sch.fuse(*r_loops)
         return is_inner_reduction, c_factor
 
-    def _sch_inner_reduction(  # pylint: disable=too-many-arguments
+    def _sch_inner_reduction(  # pylint: disable=too-many-arguments,too-many-locals
         self,
         sch: tir.Schedule,
         target: Target,
         block: tir.schedule.BlockRV,
         unroll_spatial_factor: Optional[int],
         epilogue_info: Optional[BlockInfo],
+        tunable: bool = False,
     ):
         # pylint: disable=invalid-name
+        block_stmt = sch.get(block)
         _, r, _ = sch.get_loops(block)
         (len_tx,) = utils.suggest_threads_per_block(  # pylint: disable=unbalanced-tuple-unpacking
             target, [sch.get(r)]
         )
+        if tunable:
+            # Let the tuner choose among the neighbours of the suggested extent, as the best one
+            # depends on the GPU and on the shape of the GEMV
+            max_threads = int(utils.max_threads_per_block(target))
+            len_r = sch.get(r).extent
+            if isinstance(len_r, tir.IntImm):
+                max_threads = min(max_threads, len_r.value)
+            candidates = [n for n in (len_tx // 2, len_tx, len_tx * 2) if 1 <= n <= max_threads]
+            len_tx = sch.sample_categorical(
+                candidates=candidates,
+                probs=[1.0 / len(candidates)] * len(candidates),
+            )
 
         _, tx = sch.split(r, factors=[None, len_tx])
         # Schedule the RF block
         rf = sch.rfactor(tx, 0)
-        bx, r, tx, _ = sch.get_loops(rf)
+        bx, r, tx, c = sch.get_loops(rf)
         sch.reorder(bx, tx, r)
         sch.bind(bx, "blockIdx.x")
         sch.bind(tx, "threadIdx.x")
         sch.set_scope(rf, 0, "local")
         sch.decompose_reduction(rf, r)
+        len_c = sch.get(c).extent
+        if isinstance(len_c, tir.IntImm) and len_c.value > 1:
+            sch.unroll(c)
+        # When the c-loop splits the reduction, each thread reads a contiguous chunk of the
+        # vector operands per step of `r`, so load the chunk into registers with vectorized loads
+        # instead of one scalar load per element
+        if (
+            unroll_spatial_factor is None
+            and isinstance(len_c, tir.IntImm)
+            and len_c.value > 1
+            and len_c.value & (len_c.value - 1) == 0
+        ):
+            for buffer in _get_vector_read_buffers(block_stmt, len_c.value):
+                len_vec = min(len_c.value, _get_max_vector_len(target, buffer.dtype))
+                read_indices = [
+                    i
+                    for i, buffer_region in enumerate(sch.get(rf).reads)
+                    if buffer_region.buffer.same_as(buffer)
+                ]
+                if len_vec < 2 or len(read_indices) != 1:
+                    continue
+                cache = sch.cache_read(rf, read_indices[0], "local")
+                sch.compute_at(cache, r)
+                # The innermost loop of the cache copies the chunk, split it into vectors the
+                # target supports
+                *_, vec = sch.get_loops(cache)
+                if len_vec < len_c.value:
+                    _, vec = sch.split(vec, factors=[None, len_vec])
+                sch.vectorize(vec)
         # Schedule the write back block
         sch.reverse_compute_at(block, bx, preserve_unit_loops=True)
         _, tx, *s = sch.get_loops(block)
@@ -216,6 +370,7 @@ class DecodeGEMV(ScheduleRule):
         if unroll_spatial_factor:
             s, inner = sch.split(s, factors=[None, unroll_spatial_factor])
             sch.reorder(s, tx, inner)
+            sch.unroll(inner)
         sch.bind(tx, "threadIdx.x")
         # Schedule epilogue
         if epilogue_info is not None:
@@ -224,7 +379,26 @@ class DecodeGEMV(ScheduleRule):
             if _is_broadcast_epilogue(sch, block, epilogue):
                 sch.set_scope(block, 0, "shared")
                 _, *s = sch.get_loops(epilogue)  # pylint: disable=invalid-name
-                _, tx = sch.split(sch.fuse(*s), factors=[None, len_tx])
+                s = sch.fuse(*s)
+                len_s = sch.get(s).extent
+                epilogue_stmt = sch.get(epilogue)
+                len_vec = min(
+                    [_EPILOGUE_VECTOR_LEN]
+                    + [
+                        _get_max_vector_len(target, region.buffer.dtype)
+                        for region in (*epilogue_stmt.reads, *epilogue_stmt.writes)
+                    ]
+                )
+                if (
+                    len_vec >= 2
+                    and isinstance(len_tx, int)
+                    and isinstance(len_s, tir.IntImm)
+                    and len_s.value % (len_tx * len_vec) == 0
+                ):
+                    _, tx, vec = sch.split(s, factors=[None, len_tx, len_vec])
+                    sch.vectorize(vec)
+                else:
+                    _, tx = sch.split(s, factors=[None, len_tx])
                 sch.bind(tx, "threadIdx.x")
             else:
                 sch.set_scope(block, 0, "local")
@@ -240,18 +414,23 @@ class DecodeGEMV(ScheduleRule):
     ):
         # pylint: disable=invalid-name
         s, r, _ = sch.get_loops(block)
-        len_tx, len_ty = 16, 16
+        len_tx, len_ty = _INNER_SPATIAL_TX, _INNER_SPATIAL_TY
         _, _ = sch.split(s, factors=[None, len_tx])
         _, ty = sch.split(r, factors=[None, len_ty])
         # Schedule the RF block
         rf = sch.rfactor(ty, 0)
-        bx, tx, r, ty, _ = sch.get_loops(rf)
+        bx, tx, r, ty, c = sch.get_loops(rf)
         sch.reorder(bx, tx, ty, r)
+        # The dominant read is contiguous along the spatial axis here, so threadIdx.x must stay on
+        # the spatial loop for the warp's loads of the weight to coalesce
         sch.bind(tx, "threadIdx.x")
         sch.bind(ty, "threadIdx.y")
         sch.bind(bx, "blockIdx.x")
         sch.set_scope(rf, 0, "local")
         sch.decompose_reduction(rf, r)
+        len_c = sch.get(c).extent
+        if isinstance(len_c, tir.IntImm) and len_c.value > 1:
+            sch.unroll(c)
         # Schedule the write back block
         sch.reverse_compute_at(block, bx, preserve_unit_loops=True)
         _, r, *s = sch.get_loops(block)
@@ -260,6 +439,7 @@ class DecodeGEMV(ScheduleRule):
         if unroll_spatial_factor:
             s, inner = sch.split(s, factors=[None, unroll_spatial_factor])
             sch.reorder(s, r, inner)
+            sch.unroll(inner)
         sch.bind(s, "threadIdx.x")
         sch.bind(r, "threadIdx.y")
         # Schedule epilogue
@@ -271,7 +451,7 @@ class DecodeGEMV(ScheduleRule):
                 _, *s = sch.get_loops(epilogue)  # pylint: disable=invalid-name
                 _, tx, ty = sch.split(sch.fuse(*s), factors=[None, len_tx, len_ty])
                 sch.bind(tx, "threadIdx.x")
-                sch.bind(ty, "threadIdx.x")
+                sch.bind(ty, "threadIdx.y")
             else:
                 sch.set_scope(block, 0, "local")
         # pylint: enable=invalid-name
@@ -15,13 +15,39 @@
 # specific language governing permissions and limitations
 # under the License.
 # pylint: disable=missing-docstring,line-too-long,invalid-name,too-few-public-methods,too-many-locals
+import tvm
+import tvm.testing
 from tvm import dlight as dl
+from tvm import tir
 from tvm.ir import assert_structural_equal
 from tvm.script import ir as I
 from tvm.script import tir as T
 from tvm.target import Target
 
 
+# fmt: off
+@T.prim_func
+def _DECODE_GEMV_1(W: T.Buffer((4096, 512), "uint32"), S: T.Buffer((4096, 128), "float16"), V: T.Buffer((1, 1, 4096), "float16"), C: T.Buffer((1, 1, 4096), "float16")):
+    T.func_attr({"global_symbol": "main", "tir.noalias": T.bool(True)})
+    # with T.block("root"):
+    B = T.alloc_buffer((4096, 4096), "float16")
+    for i, j in T.grid(4096, 4096):
+        with T.block("decode"):
+            v_i, v_j = T.axis.remap("SS", [i, j])
+            T.reads(W[v_i, v_j // 8], S[v_i, v_j // 32])
+            T.writes(B[v_i, v_j])
+            B[v_i, v_j] = (T.Cast("float16", T.bitwise_and(T.shift_right(W[v_i, v_j // 8], T.Cast("uint32", v_j % 8) * T.uint32(4)), T.uint32(15))) - T.float16(7)) * S[v_i, v_j // 32]
+    for i0, i1, i2, k in T.grid(1, 1, 4096, 4096):
+        with T.block("matmul"):
+            v_i0, v_i1, v_i2, v_k = T.axis.remap("SSSR", [i0, i1, i2, k])
+            T.reads(V[v_i0, v_i1, v_k], B[v_i2, v_k])
+            T.writes(C[v_i0, v_i1, v_i2])
+            with T.init():
+                C[v_i0, v_i1, v_i2] = T.float16(0)
+            C[v_i0, v_i1, v_i2] = C[v_i0, v_i1, v_i2] + V[v_i0, v_i1, v_k] * B[v_i2, v_k]
+# fmt: on
+
+
 def test_decode_gemv_1():
     # NK layout + K as decode dim
     # fmt: off
@@ -55,17 +81,25 @@ def test_decode_gemv_1():
             T.func_attr({"global_symbol": "main", "tir.is_scheduled": 1, "tir.noalias": T.bool(True)})
             # with T.block("root"):
             C_rf_local = T.alloc_buffer((256, 1, 1, 4096), "float16", scope="local")
+            V_local = T.alloc_buffer((1, 1, 4096), "float16", scope="local")
             for i2_i0_i1_fused in T.thread_binding(4096, thread="blockIdx.x"):
                 for k_0_fused_1 in T.thread_binding(256, thread="threadIdx.x"):
                     with T.block("matmul_rf_init"):
                         vk_0_fused_1 = T.axis.spatial(256, k_0_fused_1)
                         v_i2 = T.axis.spatial(4096, i2_i0_i1_fused)
                         C_rf_local[vk_0_fused_1, 0, 0, v_i2] = T.float16(0)
-                    for k_0_fused_0, k_1 in T.grid(2, 8):
-                        with T.block("matmul_rf_update"):
-                            vk_0_fused_1 = T.axis.spatial(256, k_0_fused_1)
-                            v_i2, vk_0_fused_0, vk_1 = T.axis.remap("SRR", [i2_i0_i1_fused, k_0_fused_0, k_1])
-                            C_rf_local[vk_0_fused_1, 0, 0, v_i2] = C_rf_local[vk_0_fused_1, 0, 0, v_i2] + V[0, 0, vk_0_fused_0 * 2048 + vk_0_fused_1 * 8 + vk_1] * ((T.Cast("float16", T.bitwise_and(T.shift_right(W[v_i2, (vk_0_fused_0 * 2048 + vk_0_fused_1 * 8 + vk_1) // 8], T.Cast("uint32", (vk_0_fused_0 * 2048 + vk_0_fused_1 * 8 + vk_1) % 8) * T.uint32(4)), T.uint32(15))) - T.float16(7)) * S[v_i2, (vk_0_fused_0 * 2048 + vk_0_fused_1 * 8 + vk_1) // 32])
+                    for k_0_fused_0 in range(2):
+                        for ax0 in T.vectorized(8):
+                            with T.block("V_local"):
+                                v0 = T.axis.spatial(1, 0)
+                                v1 = T.axis.spatial(1, 0)
+                                v2 = T.axis.spatial(4096, k_0_fused_0 * 2048 + k_0_fused_1 * 8 + ax0)
+                                V_local[v0, v1, v2] = V[v0, v1, v2]
+                        for k_1 in T.unroll(8):
+                            with T.block("matmul_rf_update"):
+                                vk_0_fused_1 = T.axis.spatial(256, k_0_fused_1)
+                                v_i2, vk_0_fused_0, vk_1 = T.axis.remap("SRR", [i2_i0_i1_fused, k_0_fused_0, k_1])
+                                C_rf_local[vk_0_fused_1, 0, 0, v_i2] = C_rf_local[vk_0_fused_1, 0, 0, v_i2] + V_local[0, 0, vk_0_fused_0 * 2048 + vk_0_fused_1 * 8 + vk_1] * ((T.Cast("float16", T.bitwise_and(T.shift_right(W[v_i2, (vk_0_fused_0 * 2048 + vk_0_fused_1 * 8 + vk_1) // 8], T.Cast("uint32", (vk_0_fused_0 * 2048 + vk_0_fused_1 * 8 + vk_1) % 8) * T.uint32(4)), T.uint32(15))) - T.float16(7)) * S[v_i2, (vk_0_fused_0 * 2048 + vk_0_fused_1 * 8 + vk_1) // 32])
                 for ax1_ax2_ax3_fused in range(1): # pylint: disable=unused-variable
                     for ax0_fused in T.thread_binding(256, thread="threadIdx.x"):
                         with T.block("matmul"):
@@ -82,6 +116,103 @@ def test_decode_gemv_1():
     assert_structural_equal(mod, After)
 
 
+def test_decode_gemv_1_uint8():
+    # NK layout + K as decode dim, with two 4-bit values packed per byte
+    # fmt: off
+    @I.ir_module
+    class Before:
+        @T.prim_func
+        def func(W: T.Buffer((4096, 2048), "uint8"), S: T.Buffer((4096, 128), "float16"), V: T.Buffer((1, 1, 4096), "float16"), C: T.Buffer((1, 1, 4096), "float16")):
+            T.func_attr({"global_symbol": "main", "tir.noalias": T.bool(True)})
+            # with T.block("root"):
+            B = T.alloc_buffer((4096, 4096), "float16")
+            for i, j in T.grid(4096, 4096):
+                with T.block("decode"):
+                    v_i, v_j = T.axis.remap("SS", [i, j])
+                    T.reads(W[v_i, v_j // 2], S[v_i, v_j // 32])
+                    T.writes(B[v_i, v_j])
+                    B[v_i, v_j] = (T.Cast("float16", T.bitwise_and(T.shift_right(W[v_i, v_j // 2], T.Cast("uint8", v_j % 2) * T.uint8(4)), T.uint8(15))) - T.float16(7)) * S[v_i, v_j // 32]
+            for i0, i1, i2, k in T.grid(1, 1, 4096, 4096):
+                with T.block("matmul"):
+                    v_i0, v_i1, v_i2, v_k = T.axis.remap("SSSR", [i0, i1, i2, k])
+                    T.reads(V[v_i0, v_i1, v_k], B[v_i2, v_k])
+                    T.writes(C[v_i0, v_i1, v_i2])
+                    with T.init():
+                        C[v_i0, v_i1, v_i2] = T.float16(0)
+                    C[v_i0, v_i1, v_i2] = C[v_i0, v_i1, v_i2] + V[v_i0, v_i1, v_k] * B[v_i2, v_k]
+
+
+    @I.ir_module
+    class After:
+        @T.prim_func
+        def func(W: T.Buffer((4096, 2048), "uint8"), S: T.Buffer((4096, 128), "float16"), V: T.Buffer((1, 1, 4096), "float16"), C: T.Buffer((1, 1, 4096), "float16")):
+            T.func_attr({"global_symbol": "main", "tir.is_scheduled": 1, "tir.noalias": T.bool(True)})
+            # with T.block("root"):
+            C_rf_local = T.alloc_buffer((256, 1, 1, 4096), "float16", scope="local")
+            V_local = T.alloc_buffer((1, 1, 4096), "float16", scope="local")
+            for i2_i0_i1_fused in T.thread_binding(4096, thread="blockIdx.x"):
+                for k_0_fused_1 in T.thread_binding(256, thread="threadIdx.x"):
+                    with T.block("matmul_rf_init"):
+                        vk_0_fused_1 = T.axis.spatial(256, k_0_fused_1)
+                        v_i2 = T.axis.spatial(4096, i2_i0_i1_fused)
+                        C_rf_local[vk_0_fused_1, 0, 0, v_i2] = T.float16(0)
+                    for k_0_fused_0 in range(8):
+                        for ax0 in T.vectorized(2):
+                            with T.block("V_local"):
+                                v0 = T.axis.spatial(1, 0)
+                                v1 = T.axis.spatial(1, 0)
+                                v2 = T.axis.spatial(4096, k_0_fused_0 * 512 + k_0_fused_1 * 2 + ax0)
+                                V_local[v0, v1, v2] = V[v0, v1, v2]
+                        for k_1 in T.unroll(2):
+                            with T.block("matmul_rf_update"):
+                                vk_0_fused_1 = T.axis.spatial(256, k_0_fused_1)
+                                v_i2, vk_0_fused_0, vk_1 = T.axis.remap("SRR", [i2_i0_i1_fused, k_0_fused_0, k_1])
+                                C_rf_local[vk_0_fused_1, 0, 0, v_i2] = C_rf_local[vk_0_fused_1, 0, 0, v_i2] + V_local[0, 0, vk_0_fused_0 * 512 + vk_0_fused_1 * 2 + vk_1] * ((T.Cast("float16", T.bitwise_and(T.shift_right(W[v_i2, (vk_0_fused_0 * 512 + vk_0_fused_1 * 2 + vk_1) // 2], T.Cast("uint8", (vk_0_fused_0 * 512 + vk_0_fused_1 * 2 + vk_1) % 2) * T.uint8(4)), T.uint8(15))) - T.float16(7)) * S[v_i2, (vk_0_fused_0 * 512 + vk_0_fused_1 * 2 + vk_1) // 32])
+                for ax1_ax2_ax3_fused in range(1): # pylint: disable=unused-variable
+                    for ax0_fused in T.thread_binding(256, thread="threadIdx.x"):
+                        with T.block("matmul"):
+                            vk_0_fused_1 = T.axis.reduce(256, ax0_fused)
+                            v_i2 = T.axis.spatial(4096, i2_i0_i1_fused)
+                            with T.init():
+                                C[0, 0, v_i2] = T.float16(0)
+                            C[0, 0, v_i2] = C[0, 0, v_i2] + C_rf_local[vk_0_fused_1, 0, 0, v_i2]
+    # fmt: on
+
+    target = Target("nvidia/geforce-rtx-3090-ti")
+    with target:
+        mod = dl.ApplyDefaultSchedule(dl.gpu.DecodeGEMV())(Before)  # pylint: disable=not-callable
+    assert_structural_equal(mod, After)
+
+
+def test_decode_gemv_1_gathered_vector():
+    # NK layout + K as decode dim, with the vector row selected through an index buffer
+    # fmt: off
+    @T.prim_func
+    def func(W: T.Buffer((4096, 512), "uint32"), S: T.Buffer((4096, 128), "float16"), V: T.Buffer((8, 4096), "float16"), row_idx: T.Buffer((1,), "int32"), C: T.Buffer((1, 4096), "float16")):
+        T.func_attr({"global_symbol": "main", "tir.noalias": T.bool(True)})
+        # with T.block("root"):
+        B = T.alloc_buffer((4096, 4096), "float16")
+        for i, j in T.grid(4096, 4096):
+            with T.block("decode"):
+                v_i, v_j = T.axis.remap("SS", [i, j])
+                T.reads(W[v_i, v_j // 8], S[v_i, v_j // 32])
+                T.writes(B[v_i, v_j])
+                B[v_i, v_j] = (T.Cast("float16", T.bitwise_and(T.shift_right(W[v_i, v_j // 8], T.Cast("uint32", v_j % 8) * T.uint32(4)), T.uint32(15))) - T.float16(7)) * S[v_i, v_j // 32]
+        for i0, i1, k in T.grid(1, 4096, 4096):
+            with T.block("matmul"):
+                v_i0, v_i1, v_k = T.axis.remap("SSR", [i0, i1, k])
+                T.reads(row_idx[0], V[row_idx[0], v_k], B[v_i1, v_k])
+                T.writes(C[v_i0, v_i1])
+                with T.init():
+                    C[v_i0, v_i1] = T.float16(0)
+                C[v_i0, v_i1] = C[v_i0, v_i1] + V[row_idx[0], v_k] * B[v_i1, v_k]
+    # fmt: on
+
+    # The buffer vars behind `row_idx[0]` must not make V look like the dominant read
+    target = Target("nvidia/geforce-rtx-3090-ti")
+    assert dl.gpu.DecodeGEMV().apply(func, target, False) is not None
+
+
 def test_decode_gemv_2():
     # KN layout + K as decode dim
     # fmt: off
@@ -122,12 +253,13 @@ def test_decode_gemv_2():
                             vk_0_fused_1 = T.axis.spatial(16, k_0_fused_1)
                             v_i2 = T.axis.spatial(4096, i2_i0_i1_fused_0 * 16 + i2_i0_i1_fused_1)
                             C_rf_local[vk_0_fused_1, 0, 0, v_i2] = T.float16(0)
-                        for k_0_fused_0, k_1 in T.grid(32, 8):
-                            with T.block("matmul_rf_update"):
-                                vk_0_fused_1 = T.axis.spatial(16, k_0_fused_1)
-                                v_i2 = T.axis.spatial(4096, i2_i0_i1_fused_0 * 16 + i2_i0_i1_fused_1)
-                                vk_0_fused_0, vk_1 = T.axis.remap("RR", [k_0_fused_0, k_1])
-                                C_rf_local[vk_0_fused_1, 0, 0, v_i2] = C_rf_local[vk_0_fused_1, 0, 0, v_i2] + V[0, 0, vk_0_fused_0 * 128 + vk_0_fused_1 * 8 + vk_1] * ((T.Cast("float16", T.bitwise_and(T.shift_right(W[(vk_0_fused_0 * 128 + vk_0_fused_1 * 8 + vk_1) // 8, v_i2], T.Cast("uint32", (vk_0_fused_0 * 128 + vk_0_fused_1 * 8 + vk_1) % 8) * T.uint32(4)), T.uint32(15))) - T.float16(7)) * S[(vk_0_fused_0 * 128 + vk_0_fused_1 * 8 + vk_1) // 32, v_i2])
+                        for k_0_fused_0 in range(32):
+                            for k_1 in T.unroll(8):
+                                with T.block("matmul_rf_update"):
+                                    vk_0_fused_1 = T.axis.spatial(16, k_0_fused_1)
+                                    v_i2 = T.axis.spatial(4096, i2_i0_i1_fused_0 * 16 + i2_i0_i1_fused_1)
+                                    vk_0_fused_0, vk_1 = T.axis.remap("RR", [k_0_fused_0, k_1])
+                                    C_rf_local[vk_0_fused_1, 0, 0, v_i2] = C_rf_local[vk_0_fused_1, 0, 0, v_i2] + V[0, 0, vk_0_fused_0 * 128 + vk_0_fused_1 * 8 + vk_1] * ((T.Cast("float16", T.bitwise_and(T.shift_right(W[(vk_0_fused_0 * 128 + vk_0_fused_1 * 8 + vk_1) // 8, v_i2], T.Cast("uint32", (vk_0_fused_0 * 128 + vk_0_fused_1 * 8 + vk_1) % 8) * T.uint32(4)), T.uint32(15))) - T.float16(7)) * S[(vk_0_fused_0 * 128 + vk_0_fused_1 * 8 + vk_1) // 32, v_i2])
                 for ax1_ax2_ax3_fused in T.thread_binding(16, thread="threadIdx.x"):
                     for ax0_fused in T.thread_binding(16, thread="threadIdx.y"):
                         with T.block("matmul"):
@@ -185,15 +317,16 @@ def test_decode_gemv_3():
                             vk_fused_1 = T.axis.spatial(256, k_fused_1)
                             v_i2 = T.axis.spatial(4096, i2_0_i0_i1_fused * 8 + i2_1_init)
                             C_rf_local[vk_fused_1, 0, 0, v_i2] = T.float16(0)
-                    for k_fused_0, i2_1 in T.grid(16, 8):
-                        with T.block("matmul_rf_update"):
-                            vk_fused_1 = T.axis.spatial(256, k_fused_1)
-                            v_i2 = T.axis.spatial(4096, i2_0_i0_i1_fused * 8 + i2_1)
-                            vk_fused_0 = T.axis.reduce(16, k_fused_0)
-                            C_rf_local[vk_fused_1, 0, 0, v_i2] = C_rf_local[vk_fused_1, 0, 0, v_i2] + V[0, 0, vk_fused_0 * 256 + vk_fused_1] * ((T.Cast("float16", T.bitwise_and(T.shift_right(W[v_i2 // 8, vk_fused_0 * 256 + vk_fused_1], T.Cast("uint32", v_i2 % 8) * T.uint32(4)), T.uint32(15))) - T.float16(7)) * S[v_i2 // 32, vk_fused_0 * 256 + vk_fused_1])
+                    for k_fused_0 in range(16):
+                        for i2_1 in T.unroll(8):
+                            with T.block("matmul_rf_update"):
+                                vk_fused_1 = T.axis.spatial(256, k_fused_1)
+                                v_i2 = T.axis.spatial(4096, i2_0_i0_i1_fused * 8 + i2_1)
+                                vk_fused_0 = T.axis.reduce(16, k_fused_0)
+                                C_rf_local[vk_fused_1, 0, 0, v_i2] = C_rf_local[vk_fused_1, 0, 0, v_i2] + V[0, 0, vk_fused_0 * 256 + vk_fused_1] * ((T.Cast("float16", T.bitwise_and(T.shift_right(W[v_i2 // 8, vk_fused_0 * 256 + vk_fused_1], T.Cast("uint32", v_i2 % 8) * T.uint32(4)), T.uint32(15))) - T.float16(7)) * S[v_i2 // 32, vk_fused_0 * 256 + vk_fused_1])
                 for ax1_ax2_ax3_fused_0 in range(1):
                     for ax0_fused in T.thread_binding(256, thread="threadIdx.x"):
-                        for ax1_ax2_ax3_fused_1 in range(8):
+                        for ax1_ax2_ax3_fused_1 in T.unroll(8):
                             with T.block("matmul"):
                                 vk_fused_1 = T.axis.reduce(256, ax0_fused)
                                 v_i2 = T.axis.spatial(4096, i2_0_i0_i1_fused * 8 + ax1_ax2_ax3_fused_0 * 8 + ax1_ax2_ax3_fused_1)
@@ -250,15 +383,16 @@ def test_decode_gemv_4():
                                 vk_fused_1 = T.axis.spatial(16, k_fused_1)
                                 v_i2 = T.axis.spatial(4096, i2_0_i0_i1_fused_0 * 128 + i2_0_i0_i1_fused_1 * 8 + i2_1_init)
                                 C_rf_local[vk_fused_1, 0, 0, v_i2] = T.float16(0)
-                        for k_fused_0, i2_1 in T.grid(256, 8):
-                            with T.block("matmul_rf_update"):
-                                vk_fused_1 = T.axis.spatial(16, k_fused_1)
-                                v_i2 = T.axis.spatial(4096, i2_0_i0_i1_fused_0 * 128 + i2_0_i0_i1_fused_1 * 8 + i2_1)
-                                vk_fused_0 = T.axis.reduce(256, k_fused_0)
-                                C_rf_local[vk_fused_1, 0, 0, v_i2] = C_rf_local[vk_fused_1, 0, 0, v_i2] + V[0, 0, vk_fused_0 * 16 + vk_fused_1] * ((T.Cast("float16", T.bitwise_and(T.shift_right(W[vk_fused_0 * 16 + vk_fused_1, v_i2 // 8], T.Cast("uint32", v_i2 % 8) * T.uint32(4)), T.uint32(15))) - T.float16(7)) * S[vk_fused_0 * 16 + vk_fused_1, v_i2 // 32])
+                        for k_fused_0 in range(256):
+                            for i2_1 in T.unroll(8):
+                                with T.block("matmul_rf_update"):
+                                    vk_fused_1 = T.axis.spatial(16, k_fused_1)
+                                    v_i2 = T.axis.spatial(4096, i2_0_i0_i1_fused_0 * 128 + i2_0_i0_i1_fused_1 * 8 + i2_1)
+                                    vk_fused_0 = T.axis.reduce(256, k_fused_0)
+                                    C_rf_local[vk_fused_1, 0, 0, v_i2] = C_rf_local[vk_fused_1, 0, 0, v_i2] + V[0, 0, vk_fused_0 * 16 + vk_fused_1] * ((T.Cast("float16", T.bitwise_and(T.shift_right(W[vk_fused_0 * 16 + vk_fused_1, v_i2 // 8], T.Cast("uint32", v_i2 % 8) * T.uint32(4)), T.uint32(15))) - T.float16(7)) * S[vk_fused_0 * 16 + vk_fused_1, v_i2 // 32])
                 for ax1_ax2_ax3_fused_0 in T.thread_binding(16, thread="threadIdx.x"):
                     for ax0_fused in T.thread_binding(16, thread="threadIdx.y"):
-                        for ax1_ax2_ax3_fused_1 in range(8):
+                        for ax1_ax2_ax3_fused_1 in T.unroll(8):
                             with T.block("matmul"):
                                 vk_fused_1 = T.axis.reduce(16, ax0_fused)
                                 v_i2 = T.axis.spatial(4096, i2_0_i0_i1_fused_0 * 128 + ax1_ax2_ax3_fused_0 * 8 + ax1_ax2_ax3_fused_1)
@@ -274,6 +408,86 @@ def test_decode_gemv_4():
     assert_structural_equal(mod, After)
 
 
+def test_decode_gemv_2_broadcast_epilogue():
+    # KN layout + K as decode dim, with an epilogue broadcasting the GEMV result
+    # fmt: off
+    @I.ir_module
+    class Before:
+        @T.prim_func
+        def func(W: T.Buffer((512, 4096), "uint32"), S: T.Buffer((128, 4096), "float16"), V: T.Buffer((1, 1, 4096), "float16"), X: T.Buffer((4096, 16), "float16"), D: T.Buffer((4096, 16), "float16")):
+            T.func_attr({"global_symbol": "main", "tir.noalias": T.bool(True)})
+            # with T.block("root"):
+            B = T.alloc_buffer((4096, 4096), "float16")
+            C = T.alloc_buffer((1, 1, 4096), "float16")
+            for i, j in T.grid(4096, 4096):
+                with T.block("decode"):
+                    v_i, v_j = T.axis.remap("SS", [i, j])
+                    T.reads(W[v_i // 8, v_j], S[v_i // 32, v_j])
+                    T.writes(B[v_i, v_j])
+                    B[v_i, v_j] = (T.Cast("float16", T.bitwise_and(T.shift_right(W[v_i // 8, v_j], T.Cast("uint32", v_i % 8) * T.uint32(4)), T.uint32(15))) - T.float16(7)) * S[v_i // 32, v_j]
+            for i0, i1, i2, k in T.grid(1, 1, 4096, 4096):
+                with T.block("matmul"):
+                    v_i0, v_i1, v_i2, v_k = T.axis.remap("SSSR", [i0, i1, i2, k])
+                    T.reads(V[v_i0, v_i1, v_k], B[v_k, v_i2])
+                    T.writes(C[v_i0, v_i1, v_i2])
+                    with T.init():
+                        C[v_i0, v_i1, v_i2] = T.float16(0)
+                    C[v_i0, v_i1, v_i2] = C[v_i0, v_i1, v_i2] + V[v_i0, v_i1, v_k] * B[v_k, v_i2]
+            for i, j in T.grid(4096, 16):
+                with T.block("epilogue"):
+                    v_i, v_j = T.axis.remap("SS", [i, j])
+                    T.reads(C[0, 0, v_i], X[v_i, v_j])
+                    T.writes(D[v_i, v_j])
+                    D[v_i, v_j] = C[0, 0, v_i] + X[v_i, v_j]
+    # fmt: on
+
+    target = Target("nvidia/geforce-rtx-3090-ti")
+    with target:
+        mod = dl.ApplyDefaultSchedule(dl.gpu.DecodeGEMV())(Before)  # pylint: disable=not-callable
+    # The epilogue is distributed over both thread axes of the block
+    sch = tir.Schedule(mod)
+    thread_tags = set()
+    for loop in sch.get_loops(sch.get_block("epilogue", func_name="func")):
+        loop = sch.get(loop)
+        if loop.kind == tir.ForKind.THREAD_BINDING:
+            thread_tags.add(loop.thread_binding.thread_tag)
+    assert thread_tags == {"blockIdx.x", "threadIdx.x", "threadIdx.y"}
+
+
+def test_decode_gemv_1_tunable():
+    # NK layout + K as decode dim, with the thread extent left to the tuner
+    target = Target("nvidia/geforce-rtx-3090-ti")
+    sch = dl.gpu.DecodeGEMV().apply(_DECODE_GEMV_1, target, True)
+    assert isinstance(sch, tir.Schedule)
+    (inst,) = [inst for inst in sch.trace.insts if inst.kind.name == "SampleCategorical"]
+    assert [int(c) for c in inst.attrs[0]] == [128, 256, 512]
+
+
+def test_decode_gemv_1_metal():
+    # NK layout + K as decode dim, on a target without 8-lane fp16 vectors
+    target = Target("metal")
+    mod = tvm.IRModule({"main": _DECODE_GEMV_1})
+    with target:
+        mod = dl.ApplyDefaultSchedule(dl.gpu.DecodeGEMV())(mod)  # pylint: disable=not-callable
+    # The 8 elements of V used by a thread per step are loaded as two 4-lane vectors
+    sch = tir.Schedule(mod)
+    loops = [sch.get(loop) for loop in sch.get_loops(sch.get_block("V_local", func_name="main"))]
+    assert loops[-1].kind == tir.ForKind.VECTORIZED
+    assert [int(loop.extent) for loop in loops[-2:]] == [2, 4]
+
+
+@tvm.testing.requires_cuda
+def test_decode_gemv_1_cuda_source():
+    # NK layout + K as decode dim, checked on the generated CUDA source
+    target = Target("nvidia/geforce-rtx-3090-ti")
+    mod = tvm.IRModule({"main": _DECODE_GEMV_1})
+    with target:
+        mod = dl.ApplyDefaultSchedule(dl.gpu.DecodeGEMV())(mod)  # pylint: disable=not-callable
+    source = tvm.build(mod, target=target).imported_modules[0].get_source()
+    # The 8 fp16 elements of V used by a thread per step are fetched with one 128-bit load
+    assert "uint4" in source
+
+
 def test_decode_gemv_sigmoid():
     # NK layout + K as decode dim
     # fmt: off
@@ -314,17 +528,25 @@ def test_decode_gemv_sigmoid():
             # with T.block("root"):
             C_local = T.alloc_buffer((1, 1, 4096), "float16", scope="local")
             C_rf_local = T.alloc_buffer((256, 1, 1, 4096), "float16", scope="local")
+            V_local = T.alloc_buffer((1, 1, 4096), "float16", scope="local")
             for i2_i0_i1_fused in T.thread_binding(4096, thread="blockIdx.x"):
                 for k_0_fused_1 in T.thread_binding(256, thread="threadIdx.x"):
                     with T.block("matmul_rf_init"):
                         vk_0_fused_1 = T.axis.spatial(256, k_0_fused_1)
                         v_i2 = T.axis.spatial(4096, i2_i0_i1_fused)
                         C_rf_local[vk_0_fused_1, 0, 0, v_i2] = T.float16(0)
-                    for k_0_fused_0, k_1 in T.grid(2, 8):
-                        with T.block("matmul_rf_update"):
-                            vk_0_fused_1 = T.axis.spatial(256, k_0_fused_1)
-                            v_i2, vk_0_fused_0, vk_1 = T.axis.remap("SRR", [i2_i0_i1_fused, k_0_fused_0, k_1])
-                            C_rf_local[vk_0_fused_1, 0, 0, v_i2] = C_rf_local[vk_0_fused_1, 0, 0, v_i2] + V[0, 0, vk_0_fused_0 * 2048 + vk_0_fused_1 * 8 + vk_1] * ((T.Cast("float16", T.bitwise_and(T.shift_right(W[v_i2, (vk_0_fused_0 * 2048 + vk_0_fused_1 * 8 + vk_1) // 8], T.Cast("uint32", (vk_0_fused_0 * 2048 + vk_0_fused_1 * 8 + vk_1) % 8) * T.uint32(4)), T.uint32(15))) - T.float16(7)) * S[v_i2, (vk_0_fused_0 * 2048 + vk_0_fused_1 * 8 + vk_1) // 32])
+                    for k_0_fused_0 in range(2):
+                        for ax0 in T.vectorized(8):
+                            with T.block("V_local"):
+                                v0 = T.axis.spatial(1, 0)
+                                v1 = T.axis.spatial(1, 0)
+                                v2 = T.axis.spatial(4096, k_0_fused_0 * 2048 + k_0_fused_1 * 8 + ax0)
+                                V_local[v0, v1, v2] = V[v0, v1, v2]
+                        for k_1 in T.unroll(8):
+                            with T.block("matmul_rf_update"):
+                                vk_0_fused_1 = T.axis.spatial(256, k_0_fused_1)
+                                v_i2, vk_0_fused_0, vk_1 = T.axis.remap("SRR", [i2_i0_i1_fused, k_0_fused_0, k_1])
+                                C_rf_local[vk_0_fused_1, 0, 0, v_i2] = C_rf_local[vk_0_fused_1, 0, 0, v_i2] + V_local[0, 0, vk_0_fused_0 * 2048 + vk_0_fused_1 * 8 + vk_1] * ((T.Cast("float16", T.bitwise_and(T.shift_right(W[v_i2, (vk_0_fused_0 * 2048 + vk_0_fused_1 * 8 + vk_1) // 8], T.Cast("uint32", (vk_0_fused_0 * 2048 + vk_0_fused_1 * 8 + vk_1) % 8) * T.uint32(4)), T.uint32(15))) - T.float16(7)) * S[v_i2, (vk_0_fused_0 * 2048 + vk_0_fused_1 * 8 + vk_1) // 32])
                 for ax1_ax2_ax3_fused in range(1):  # pylint: disable=unused-variable
                     for ax0_fused in T.thread_binding(256, thread="threadIdx.x"):
                         with T.block("matmul"):
@@ -386,6 +608,7 @@ def test_decode_gemv_1_fp32():
             # with T.block("root"):
             C_fp32_local = T.alloc_buffer((1, 1, 4096), scope="local")
             C_fp32_rf_local = T.alloc_buffer((256, 1, 1, 4096), scope="local")
+            V_local = T.alloc_buffer((1, 1, 4096), "float16", scope="local")
             for ax0_fused in T.thread_binding(4096, thread="blockIdx.x"):
                 for ax1_0_fused_1 in T.thread_binding(256, thread="threadIdx.x"):
                     with T.block("matmul_rf_init"):
@@ -393,12 +616,21 @@ def test_decode_gemv_1_fp32():
                         T.reads()
                         T.writes(C_fp32_rf_local[vax1_0_fused_1, 0, 0, v0])
                         C_fp32_rf_local[vax1_0_fused_1, 0, 0, v0] = T.float32(0)
-                    for ax1_0_fused_0, ax1_1 in T.grid(2, 8):
-                        with T.block("matmul_rf_update"):
-                            vax1_0_fused_1, v0, vax1_0_fused_0, vax1_1 = T.axis.remap("SSRR", [ax1_0_fused_1, ax0_fused, ax1_0_fused_0, ax1_1])
-                            T.reads(C_fp32_rf_local[vax1_0_fused_1, 0, 0, v0], V[0, 0, vax1_0_fused_0 * 2048 + vax1_0_fused_1 * 8 + vax1_1], W[v0, (vax1_0_fused_0 * 2048 + vax1_0_fused_1 * 8 + vax1_1) // 8], S[v0, (vax1_0_fused_0 * 2048 + vax1_0_fused_1 * 8 + vax1_1) // 32])
-                            T.writes(C_fp32_rf_local[vax1_0_fused_1, 0, 0, v0])
-                            C_fp32_rf_local[vax1_0_fused_1, 0, 0, v0] = C_fp32_rf_local[vax1_0_fused_1, 0, 0, v0] + T.Cast("float32", V[0, 0, vax1_0_fused_0 * 2048 + vax1_0_fused_1 * 8 + vax1_1]) * T.Cast("float32", (T.Cast("float16", T.bitwise_and(T.shift_right(W[v0, (vax1_0_fused_0 * 2048 + vax1_0_fused_1 * 8 + vax1_1) // 8], T.Cast("uint32", (vax1_0_fused_0 * 2048 + vax1_0_fused_1 * 8 + vax1_1) % 8) * T.uint32(4)), T.uint32(15))) - T.float16(7)) * S[v0, (vax1_0_fused_0 * 2048 + vax1_0_fused_1 * 8 + vax1_1) // 32])
+                    for ax1_0_fused_0 in range(2):
+                        for ax0 in T.vectorized(8):
+                            with T.block("V_local"):
+                                v0 = T.axis.spatial(1, 0)
+                                v1 = T.axis.spatial(1, 0)
+                                v2 = T.axis.spatial(4096, ax1_0_fused_0 * 2048 + ax1_0_fused_1 * 8 + ax0)
+                                T.reads(V[v0, v1, v2])
+                                T.writes(V_local[v0, v1, v2])
+                                V_local[v0, v1, v2] = V[v0, v1, v2]
+                        for ax1_1 in T.unroll(8):
+                            with T.block("matmul_rf_update"):
+                                vax1_0_fused_1, v0, vax1_0_fused_0, vax1_1 = T.axis.remap("SSRR", [ax1_0_fused_1, ax0_fused, ax1_0_fused_0, ax1_1])
+                                T.reads(C_fp32_rf_local[vax1_0_fused_1, 0, 0, v0], V_local[0, 0, vax1_0_fused_0 * 2048 + vax1_0_fused_1 * 8 + vax1_1], W[v0, (vax1_0_fused_0 * 2048 + vax1_0_fused_1 * 8 + vax1_1) // 8], S[v0, (vax1_0_fused_0 * 2048 + vax1_0_fused_1 * 8 + vax1_1) // 32])
+                                T.writes(C_fp32_rf_local[vax1_0_fused_1, 0, 0, v0])
+                                C_fp32_rf_local[vax1_0_fused_1, 0, 0, v0] = C_fp32_rf_local[vax1_0_fused_1, 0, 0, v0] + T.Cast("float32", V_local[0, 0, vax1_0_fused_0 * 2048 + vax1_0_fused_1 * 8 + vax1_1]) * T.Cast("float32", (T.Cast("float16", T.bitwise_and(T.shift_right(W[v0, (vax1_0_fused_0 * 2048 + vax1_0_fused_1 * 8 + vax1_1) // 8], T.Cast("uint32", (vax1_0_fused_0 * 2048 + vax1_0_fused_1 * 8 + vax1_1) % 8) * T.uint32(4)), T.uint32(15))) - T.float16(7)) * S[v0, (vax1_0_fused_0 * 2048 + vax1_0_fused_1 * 8 + vax1_1) // 32])
                 for ax1_fused in range(1):  # pylint: disable=unused-variable
                     for ax0_fused_1 in T.thread_binding(256, thread="threadIdx.x"):
                         with T.block("matmul"):
@@ -475,13 +707,14 @@ def test_reduction_no_spatial():
                             with T.init():
                                 Ared_temp_shared[0, 0] = T.float32(0)
                             Ared_temp_shared[0, 0] = Ared_temp_shared[0, 0] + Ared_temp_rf_local[vax1_fused_1, 0, 0]
-                for ax0_fused_0 in range(16):
+                for ax0_fused_0 in range(4):
                     for ax0_fused_1 in T.thread_binding(256, thread="threadIdx.x"):
-                        with T.block("rms_norm"):
-                            v0 = T.axis.spatial(4096, ax0_fused_0 * 256 + ax0_fused_1)
-                            T.reads(B[v0], A[0, 0, v0], Ared_temp_shared[0, 0])
-                            T.writes(rms_norm[0, v0])
-                            rms_norm[0, v0] = T.Cast("float16", T.Cast("float32", B[v0]) * (T.Cast("float32", A[0, 0, v0]) / T.sqrt(Ared_temp_shared[0, 0] * T.float32(0.000244140625) + T.float32(9.9999999999999995e-07))))
+                        for ax0_fused_2 in T.vectorized(4):
+                            with T.block("rms_norm"):
+                                v0 = T.axis.spatial(4096, ax0_fused_0 * 1024 + ax0_fused_1 * 4 + ax0_fused_2)
+                                T.reads(B[v0], A[0, 0, v0], Ared_temp_shared[0, 0])
+                                T.writes(rms_norm[0, v0])
+                                rms_norm[0, v0] = T.Cast("float16", T.Cast("float32", B[v0]) * (T.Cast("float32", A[0, 0, v0]) / T.sqrt(Ared_temp_shared[0, 0] * T.float32(0.000244140625) + T.float32(9.9999999999999995e-07))))
     # fmt: on
     target = Target("nvidia/geforce-rtx-3090-ti")
     with target:
@@ -489,11 +722,87 @@ def test_reduction_no_spatial():
     assert_structural_equal(mod, After)
 
 
+def test_reduction_output_only():
+    # A reduction that reads nothing but its own output is left unscheduled
+    # fmt: off
+    @T.prim_func
+    def func(C: T.Buffer((1, 4096), "float32")):
+        T.func_attr({"global_symbol": "main", "tir.noalias": T.bool(True)})
+        for i0, i1, k in T.grid(1, 4096, 4096):
+            with T.block("count"):
+                v_i0, v_i1, v_k = T.axis.remap("SSR", [i0, i1, k])
+                T.reads(C[v_i0, v_i1])
+                T.writes(C[v_i0, v_i1])
+                with T.init():
+                    C[v_i0, v_i1] = T.float32(0)
+                C[v_i0, v_i1] = C[v_i0, v_i1] + T.float32(1)
+    # fmt: on
+
+    target = Target("nvidia/geforce-rtx-3090-ti")
+    assert dl.gpu.DecodeGEMV().apply(func, target, False) is None
+
+
+def test_reduction_unit_extent():
+    # A reduction over an extent-1 iter has no reduction loop to map to threads
+    # fmt: off
+    @T.prim_func
+    def func(A: T.Buffer((4096, 1), "float16"), C: T.Buffer((4096,), "float16")):
+        T.func_attr({"global_symbol": "main", "tir.noalias": T.bool(True)})
+        for i, k in T.grid(4096, 1):
+            with T.block("sum"):
+                v_i, v_k = T.axis.remap("SR", [i, k])
+                T.reads(A[v_i, v_k])
+                T.writes(C[v_i])
+                with T.init():
+                    C[v_i] = T.float16(0)
+                C[v_i] = C[v_i] + A[v_i, v_k]
+    # fmt: on
+
+    target = Target("nvidia/geforce-rtx-3090-ti")
+    assert dl.gpu.DecodeGEMV().apply(func, target, False) is None
+
+
+def test_reduction_iter_repeated_in_access():
+    # The dominant read splits the reduction iter across two non-adjacent dimensions
+    # fmt: off
+    @T.prim_func
+    def func(A: T.Buffer((4096, 512, 16), "float16"), V: T.Buffer((4096,), "float16"), C: T.Buffer((4096,), "float16")):
+        T.func_attr({"global_symbol": "main", "tir.noalias": T.bool(True)})
+        for i, k in T.grid(4096, 4096):
+            with T.block("matmul"):
+                v_i, v_k = T.axis.remap("SR", [i, k])
+                T.reads(V[v_k], A[v_i, v_k // 8, v_k % 8])
+                T.writes(C[v_i])
+                with T.init():
+                    C[v_i] = T.float16(0)
+                C[v_i] = C[v_i] + V[v_k] * A[v_i, v_k // 8, v_k % 8]
+    # fmt: on
+
+    target = Target("nvidia/geforce-rtx-3090-ti")
+    assert dl.gpu.DecodeGEMV().apply(func, target, False) is None
+
+
+def test_reduction_free_func(monkeypatch):
+    # A PrimFunc without any reduction is rejected before a schedule is built
+    # fmt: off
+    @T.prim_func
+    def func(A: T.Buffer((4096,), "float16"), B: T.Buffer((4096,), "float16")):
+        T.func_attr({"global_symbol": "main", "tir.noalias": T.bool(True)})
+        for i in range(4096):
+            with T.block("add"):
+                v_i = T.axis.spatial(4096, i)
+                T.reads(A[v_i])
+                T.writes(B[v_i])
+                B[v_i] = A[v_i] + T.float16(1)
+    # fmt: on
+
+    def _fail(*_args, **_kwargs):
+        raise AssertionError("DecodeGEMV built a schedule for a reduction-free PrimFunc")
+
+    monkeypatch.setattr(tir, "Schedule", _fail)
+    target = Target("nvidia/geforce-rtx-3090-ti")
+    assert dl.gpu.DecodeGEMV().apply(func, target, False) is None
+
+
 if __name__ == "__main__":
-    test_decode_gemv_1()
-    test_decode_gemv_2()
-    test_decode_gemv_3()
-    test_decode_gemv_4()
-    test_decode_gemv_sigmoid()
-    test_decode_gemv_1_fp32()
-    test_reduction_no_spatial()
+    tvm.testing.main()